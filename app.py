@@ -8,8 +8,19 @@ import os
 import base64
 import io
 import threading
+import itertools
+import time
+import traceback
+import importlib.util
 import re
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from json_store import dumps_bytes
 
 # 加载环境变量
 load_dotenv()
@@ -39,6 +50,27 @@ ZHIPU_API_KEY = os.getenv('ZHIPU_API_KEY')
 ZHIPU_API_BASE_URL = os.getenv('ZHIPU_API_BASE_URL', 'https://open.bigmodel.cn/api/paas/v4')
 ZHIPU_MODEL = os.getenv('ZHIPU_MODEL', 'autoglm-phone')
 
+# 智谱 API 请求中固定不变的部分，启动时构建一次
+ZHIPU_CHAT_URL = f"{ZHIPU_API_BASE_URL}/chat/completions"
+ZHIPU_HEADERS = {
+    "Authorization": f"Bearer {ZHIPU_API_KEY}",
+    "Content-Type": "application/json"
+}
+ZHIPU_BASE_PAYLOAD = {
+    "model": "glm-4-flash",
+    "temperature": 0.1,  # 降低温度以获得更确定的结果
+    "max_tokens": 200  # 只需返回一个很短的 JSON
+}
+
+# 智谱 API 复用同一个 Session，保持 HTTPS 长连接，避免每次语音指令都重新握手
+_ZHIPU_SESSION = requests.Session()
+_ZHIPU_SESSION.headers.update(ZHIPU_HEADERS)
+_ZHIPU_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+))
+
 # 小米配置仅从 mi/config.py 读取，不使用环境变量
 
 # 配置文件路径
@@ -51,50 +83,88 @@ DATAS_DIR = os.path.join(base_dir, 'datas')
 voice_receiver = None
 voice_receiver_lock = threading.Lock()
 
-# 全局变量：日志队列（用于推送到前端）
-log_queue = []
+# 语音指令处理线程池：AI 匹配耗时较长，放到独立线程中执行，避免阻塞语音轮询
+VOICE_HANDLER_WORKERS = 4
+_voice_executor = ThreadPoolExecutor(max_workers=VOICE_HANDLER_WORKERS, thread_name_prefix="voice-handler")
+# 设备操作单线程执行，保证按语音到达顺序生效
+_voice_action_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voice-action")
+
+# 全局变量：日志缓冲区（用于推送到前端，保存编码好的 SSE 消息）
+# 所有 SSE 连接共享同一个环形缓冲区，通过条件变量通知有新日志，
+# 每个连接只记录自己读到的序号；消费过慢的连接会跳过被挤出缓冲区的旧日志
+LOG_BUFFER_SIZE = 500
+log_queue = deque(maxlen=LOG_BUFFER_SIZE)
 log_queue_lock = threading.Lock()
-log_listeners = set()  # SSE 连接的监听器集合
+log_cv = threading.Condition(log_queue_lock)
+log_seq = 0  # 已写入的日志总数，用作日志序号
+
+# SSE 心跳间隔（秒）：常见反向代理（nginx、ALB、Cloudflare）的空闲超时约 60 秒，
+# 15 秒足以保持连接；新日志由条件变量即时唤醒，不受心跳间隔影响
+SSE_HEARTBEAT_INTERVAL = 15
+
+# SSE 日志合并推送：被唤醒后最多再等 50 毫秒凑批，每次 yield 最多合并 64 条，
+# 减少突发日志时的写入次数
+SSE_COALESCE_DELAY = 0.05
+SSE_BATCH_SIZE = 64
+
+_last_timestamp = (0, '')  # (秒级时间戳, 格式化后的字符串)
+
+def _now_timestamp():
+    """获取当前时间字符串（同一秒内复用已格式化的结果）"""
+    global _last_timestamp
+    now = int(time.time())
+    sec, timestamp = _last_timestamp
+    if now != sec:
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        _last_timestamp = (now, timestamp)
+    return timestamp
+
+def _sse_event(data):
+    """将数据编码为一条 SSE 消息（bytes）"""
+    return b"data: " + dumps_bytes(data) + b"\n\n"
+
+# 日志流连接成功消息，内容固定，只编码一次
+_SSE_CONNECTED_FRAME = _sse_event({'type': 'connected', 'message': '日志流已连接'})
+# 新连接推送的历史日志条数
+LOG_HISTORY_SIZE = 20
 
 def add_log_to_queue(log_data):
-    """添加日志到队列并推送给所有监听器"""
-    global log_queue, log_listeners
-    
-    with log_queue_lock:
-        # 添加到队列（保留最近100条）
-        log_queue.append(log_data)
-        if len(log_queue) > 100:
-            log_queue.pop(0)
-        
-        # 推送给所有 SSE 监听器
-        disconnected_listeners = []
-        for listener in log_listeners.copy():
-            try:
-                listener.put(log_data)
-            except Exception:
-                disconnected_listeners.append(listener)
-        
-        # 移除断开的连接
-        for listener in disconnected_listeners:
-            log_listeners.discard(listener)
+    """添加日志到缓冲区并唤醒所有 SSE 连接"""
+    global log_seq
+    # 每条日志只编码一次，所有 SSE 连接直接发送编码好的消息
+    frame = _sse_event(log_data)
+    with log_cv:
+        log_queue.append(frame)
+        log_seq += 1
+        log_cv.notify_all()
+
+def _read_new_logs(last_seq):
+    """读取序号 last_seq 之后的新日志（需在持有 log_cv 时调用）"""
+    count = min(log_seq - last_seq, len(log_queue))
+    return tuple(itertools.islice(log_queue, len(log_queue) - count, None))
 
 # 导入设备管理和定时任务模块
-from device_manager import register_device_routes, get_device_by_id
+from device_manager import register_device_routes, get_device_with_actions, get_devices_snapshot, iter_devices_by_ids
 from scheduler import register_schedule_routes, start_scheduler
 
-def parse_voice_command_with_ai(voice_text):
-    """使用 AI 解析语音命令，智能匹配到设备和操作"""
-    import time
-    
-    # 加载设备配置
-    from device_manager import load_devices
-    devices = load_devices()
+# 匹配 AI 返回内容首尾的 markdown 代码块标记
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```\s*$")
+
+# 设备信息提示词缓存（按 devices.json 的修改时间失效）
+_devices_prompt_cache = (None, None)  # (设备列表, 对应的提示词 JSON)
+
+def _get_devices_info_json(devices):
+    """获取用于 AI 提示词的设备信息 JSON（设备配置未变化时复用缓存）"""
+    global _devices_prompt_cache
+    cached_devices, cached_json = _devices_prompt_cache
+    if cached_devices is devices:
+        return cached_json
     
     # 构建设备信息的描述
     devices_info = []
     for device in devices:
         actions_list = []
-        for action in device.get('actions', []):
+        for action in device.get('actions') or []:
             actions_list.append({
                 "id": action.get('id'),
                 "name": action.get('name'),
@@ -108,13 +178,128 @@ def parse_voice_command_with_ai(voice_text):
             "actions": actions_list
         })
     
+    devices_info_json = json.dumps(devices_info, ensure_ascii=False, indent=2)
+    # 整体替换元组，其他线程不会读到设备列表和 JSON 不匹配的中间状态
+    _devices_prompt_cache = (devices, devices_info_json)
+    return devices_info_json
+
+class _AIRequestError(Exception):
+    """AI 接口调用失败（结果不应被缓存）"""
+
+def parse_voice_command_with_ai(voice_text):
+    """使用 AI 解析语音命令，智能匹配到设备和操作"""
+    # 检查必要的环境变量
+    if not ZHIPU_API_KEY:
+        print("❌ 未配置 ZHIPU_API_KEY")
+        return None
+    
+    try:
+        # 相同的语音内容在设备配置未变化时直接复用匹配结果
+        match = _match_voice_command(voice_text, get_devices_snapshot()["mtime"])
+    except _AIRequestError:
+        return None
+    except Exception as e:
+        print(f"❌ AI 匹配过程出错: {e}")
+        traceback.print_exc()
+        return None
+    
+    return dict(match) if match else None
+
+def _request_ai_content(data):
+    """请求智谱 API（非流式），返回模型输出的文本"""
+    response = _ZHIPU_SESSION.post(ZHIPU_CHAT_URL, json=data, timeout=10)
+    
+    if response.status_code != 200:
+        print(f"❌ AI API 调用失败: {response.status_code} - {response.text}")
+        raise _AIRequestError(response.status_code)
+    
+    result = response.json()
+    return result.get('choices', [{}])[0].get('message', {}).get('content', '').strip()
+
+class _JsonObjectScanner:
+    """逐段扫描模型输出，判断最外层 JSON 对象是否已经完整（忽略字符串中的花括号）"""
+    
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+    
+    def feed(self, text):
+        """读入一段文本，返回 JSON 对象是否已完整"""
+        for ch in text:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == '{':
+                self.depth += 1
+                self.started = True
+            elif ch == '}':
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    return True
+        return False
+
+def _request_ai_content_stream(data):
+    """以流式方式请求智谱 API，读到完整的 JSON 对象后立即关闭响应，返回模型输出的文本"""
+    response = _ZHIPU_SESSION.post(ZHIPU_CHAT_URL, json={**data, "stream": True}, stream=True, timeout=10)
+    
+    with response:
+        if response.status_code != 200:
+            print(f"❌ AI API 调用失败: {response.status_code} - {response.text}")
+            raise _AIRequestError(response.status_code)
+        
+        parts = []
+        scanner = _JsonObjectScanner()
+        # chunk_size=None：数据到达即处理，不等凑满缓冲区
+        for line in response.iter_lines(chunk_size=None):
+            # SSE 格式：data: {...}，以 data: [DONE] 结束
+            if not line.startswith(b'data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == b'[DONE]':
+                break
+            
+            chunk = json.loads(payload)
+            delta = chunk.get('choices', [{}])[0].get('delta', {}).get('content') or ''
+            parts.append(delta)
+            
+            # JSON 对象已完整，立即关闭响应，不再等待剩余输出
+            if scanner.feed(delta):
+                break
+    
+    return ''.join(parts).strip()
+
+def _parse_ai_result(content):
+    """解析模型输出的 JSON（移除可能的 markdown 代码块标记），格式无效时抛出 ValueError"""
+    content = _FENCE_RE.sub('', content).strip()
+    match_result = json.loads(content)
+    if not isinstance(match_result, dict):
+        raise ValueError(f"AI 返回结果不是 JSON 对象: {content}")
+    return match_result
+
+@lru_cache(maxsize=256)
+def _match_voice_command(voice_text, devices_mtime):
+    """调用 AI 匹配语音命令，按 (语音内容, devices.json 修改时间) 缓存结果
+
+    接口调用失败时抛出异常，避免把临时错误写入缓存。
+    """
+    snapshot = get_devices_snapshot()
+    devices_info_json = _get_devices_info_json(snapshot["devices"])
+    
     # 构建提示词
     prompt = f"""你是一个智能家居助手。用户说了一句话，请从以下设备列表中找出最匹配的设备和操作。
 
 用户说的话："{voice_text}"
 
 可用的设备和操作：
-{json.dumps(devices_info, ensure_ascii=False, indent=2)}
+{devices_info_json}
 
 请分析用户的意图，返回最匹配的设备ID和操作ID。
 如果无法匹配到任何设备或操作，返回 null。
@@ -136,78 +321,48 @@ def parse_voice_command_with_ai(voice_text):
 
 只返回 JSON，不要有其他内容。"""
     
+    data = {
+        **ZHIPU_BASE_PAYLOAD,
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    }
+    
+    print(f"🤖 正在使用 AI 匹配语音命令: {voice_text}")
     try:
-        # 调用智谱 API
-        if not ZHIPU_API_KEY:
-            print("❌ 未配置 ZHIPU_API_KEY")
-            return None
-            
-        api_url = f"{ZHIPU_API_BASE_URL}/chat/completions"
-        
-        headers = {
-            "Authorization": f"Bearer {ZHIPU_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": "glm-4-flash",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.1,  # 降低温度以获得更确定的结果
-            "max_tokens": 500
-        }
-        
-        print(f"🤖 正在使用 AI 匹配语音命令: {voice_text}")
-        response = requests.post(api_url, headers=headers, json=data, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            content = result.get('choices', [{}])[0].get('message', {}).get('content', '').strip()
-            
-            print(f"🤖 AI 返回结果: {content}")
-            
-            # 解析 JSON 结果
-            # 移除可能的 markdown 代码块标记
-            content = content.replace('```json', '').replace('```', '').strip()
-            match_result = json.loads(content)
-            
-            if match_result.get('device_id') and match_result.get('action_id'):
-                # 获取设备和操作的详细信息
-                device = get_device_by_id(match_result['device_id'])
-                if device:
-                    action = None
-                    for a in device.get('actions', []):
-                        if a.get('id') == match_result['action_id']:
-                            action = a
-                            break
-                    
-                    if action:
-                        print(f"✅ AI 匹配成功: {device.get('name')} - {action.get('name')} (置信度: {match_result.get('confidence', 'N/A')})")
-                        return {
-                            "device_id": match_result['device_id'],
-                            "action_id": match_result['action_id'],
-                            "device_name": device.get('name'),
-                            "action_name": action.get('name'),
-                            "confidence": match_result.get('confidence', 1.0),
-                            "reason": match_result.get('reason', '')
-                        }
-            
-            print(f"⚠️ AI 未能匹配到有效的设备操作: {match_result.get('reason', '未知原因')}")
-            return None
-            
-        else:
-            print(f"❌ AI API 调用失败: {response.status_code} - {response.text}")
-            return None
-            
-    except Exception as e:
-        print(f"❌ AI 匹配过程出错: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        content = _request_ai_content_stream(data)
+        print(f"🤖 AI 返回结果: {content}")
+        match_result = _parse_ai_result(content)
+    except ValueError as e:
+        # 流式输出无法解析时改用普通请求再试一次（超时、连接错误等直接抛出，不重复请求）
+        print(f"⚠️ AI 流式响应解析失败，改用普通请求: {e}")
+        content = _request_ai_content(data)
+        print(f"🤖 AI 返回结果: {content}")
+        match_result = _parse_ai_result(content)
+    
+    # 通过设备索引校验设备和操作，任一不存在即放弃匹配
+    device_id = match_result.get('device_id')
+    action_id = match_result.get('action_id')
+    entry = snapshot["actions"].get(device_id) if device_id and action_id else None
+    if entry:
+        device, actions = entry
+        action = actions.get(action_id)
+        if action:
+            print(f"✅ AI 匹配成功: {device.get('name')} - {action.get('name')} (置信度: {match_result.get('confidence', 'N/A')})")
+            return {
+                "device_id": device_id,
+                "action_id": action_id,
+                "device_name": device.get('name'),
+                "action_name": action.get('name'),
+                "confidence": match_result.get('confidence', 1.0),
+                "reason": match_result.get('reason', '')
+            }
+    
+    print(f"⚠️ AI 未能匹配到有效的设备操作: {match_result.get('reason', '未知原因')}")
+    return None
 
 @app.route('/')
 def index():
@@ -240,44 +395,77 @@ def list_icons():
             "message": str(e)
         }), 400
 
-@app.route('/api/phone-screen', methods=['GET'])
-def get_phone_screen():
-    """获取手机屏幕截图"""
+# 屏幕截图缓存：短时间内的多次请求共用同一次 adb 截图（截图失败的结果同样缓存，
+# 避免 adb 异常时排队的请求依次重试、每个都等待超时）
+SCREEN_CACHE_TTL = 0.3  # 秒
+_screen_cache = {"ts": 0.0, "png": None, "data": None, "error": None}
+_screen_lock = threading.Lock()
+
+def _capture_screen():
+    """调用 adb 截图，返回 (PNG 数据, 错误信息)，错误信息为 (message, error) 或 None"""
     try:
-        # 使用 adb 获取屏幕截图
         result = subprocess.run(
             ['adb', 'exec-out', 'screencap', '-p'],
+            stdin=subprocess.DEVNULL,
             capture_output=True,
             timeout=5
         )
+    except FileNotFoundError:
+        return None, ("未找到 ADB 命令，请确保已安装 Android SDK Platform Tools", "adb command not found")
+    except subprocess.TimeoutExpired:
+        return None, ("获取屏幕截图超时", "Command timeout")
+    except Exception as e:
+        return None, ("获取屏幕截图时出错", str(e))
+    
+    if result.returncode != 0:
+        return None, ("获取屏幕截图失败", result.stderr.decode('utf-8', errors='ignore'))
+    return result.stdout, None
+
+@app.route('/api/phone-screen', methods=['GET'])
+def get_phone_screen():
+    """获取手机屏幕截图
+
+    默认返回 base64 data URL 的 JSON；带上 ?raw=1 时直接返回 PNG 图片，
+    前端可以直接用作 <img> 的 src，省去 base64 编解码。
+    """
+    raw = request.args.get('raw')
+    try:
+        with _screen_lock:
+            # 缓存过期时才重新截图，短时间内的并发请求共用同一次截图结果
+            if time.monotonic() - _screen_cache["ts"] >= SCREEN_CACHE_TTL:
+                png, error = _capture_screen()
+                _screen_cache["png"] = png
+                _screen_cache["data"] = None
+                _screen_cache["error"] = error
+                _screen_cache["ts"] = time.monotonic()
+            
+            error = _screen_cache["error"]
+            if error is None:
+                if raw:
+                    png = _screen_cache["png"]
+                else:
+                    # 将截图转换为 base64（每张截图只编码一次）
+                    if _screen_cache["data"] is None:
+                        screenshot_base64 = base64.b64encode(_screen_cache["png"]).decode('utf-8')
+                        _screen_cache["data"] = f"data:image/png;base64,{screenshot_base64}"
+                    screenshot = _screen_cache["data"]
         
-        if result.returncode != 0:
+        if error is not None:
+            message, detail = error
             return jsonify({
                 "status": "error",
-                "message": "获取屏幕截图失败",
-                "error": result.stderr.decode('utf-8', errors='ignore')
+                "message": message,
+                "error": detail
             }), 400
         
-        # 将截图转换为 base64
-        screenshot_base64 = base64.b64encode(result.stdout).decode('utf-8')
+        if raw:
+            return Response(png, mimetype='image/png', headers={'Cache-Control': 'no-store'})
         
         return jsonify({
             "status": "success",
-            "screenshot": f"data:image/png;base64,{screenshot_base64}"
+            "screenshot": screenshot
         })
         
-    except FileNotFoundError:
-        return jsonify({
-            "status": "error",
-            "message": "未找到 ADB 命令，请确保已安装 Android SDK Platform Tools",
-            "error": "adb command not found"
-        }), 400
-    except subprocess.TimeoutExpired:
-        return jsonify({
-            "status": "error",
-            "message": "获取屏幕截图超时",
-            "error": "Command timeout"
-        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -360,9 +548,10 @@ def check_adb_device():
 def execute_device_action_internal(device_id, action_id):
     """内部执行设备操作的函数（不返回流式响应）"""
     try:
-        device = get_device_by_id(device_id)
-        if not device:
+        entry = get_device_with_actions(device_id)
+        if not entry:
             return {"status": "error", "message": f"设备 ID {device_id} 不存在"}
+        device, actions = entry
         
         # 获取设备应用名称
         app_name = device.get('app', '')
@@ -370,17 +559,15 @@ def execute_device_action_internal(device_id, action_id):
         action_name = '默认操作'
         
         # 如果指定了 action_id，从 actions 中查找对应的命令
-        if action_id and device.get('actions'):
-            for action in device.get('actions', []):
-                if action.get('id') == action_id:
-                    action_command = action.get('command', '')
-                    # 将 action.command 中的 {app} 替换为实际的应用名称
-                    if action_command and app_name:
-                        command_text = action_command.replace('{app}', app_name)
-                    else:
-                        command_text = action_command
-                    action_name = action.get('name', action_id)
-                    break
+        action = actions.get(action_id) if action_id else None
+        if action:
+            action_command = action.get('command', '')
+            # 将 action.command 中的 {app} 替换为实际的应用名称
+            if action_command and app_name:
+                command_text = action_command.replace('{app}', app_name)
+            else:
+                command_text = action_command
+            action_name = action.get('name', action_id)
         
         if not command_text:
             return {"status": "error", "message": "未找到对应的操作"}
@@ -413,33 +600,31 @@ def execute_device_action_internal(device_id, action_id):
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True,
+            bufsize=1,  # 行缓冲
             env=env
         )
         
         # 添加开始执行的消息
-        import time
         add_log_to_queue({
             'type': 'start',
             'message': f'🚀 开始执行: {device.get("name")} - {action_name}',
-            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+            'timestamp': _now_timestamp(),
             'final_command': command_text
         })
         
         # 在后台线程中等待完成并捕获输出
         def wait_process():
-            import time
             try:
                 # 读取输出
-                for line in process.stdout:
-                    if line:
-                        line_stripped = line.rstrip()
-                        print(line_stripped)
-                        # 实时推送输出到日志
-                        add_log_to_queue({
-                            'type': 'output',
-                            'line': line_stripped,
-                            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-                        })
+                for line in iter(process.stdout.readline, ''):
+                    line_stripped = line.rstrip()
+                    print(line_stripped)
+                    # 实时推送输出到日志
+                    add_log_to_queue({
+                        'type': 'output',
+                        'line': line_stripped,
+                        'timestamp': _now_timestamp()
+                    })
                 
                 process.wait()
                 
@@ -448,19 +633,19 @@ def execute_device_action_internal(device_id, action_id):
                     add_log_to_queue({
                         'type': 'success',
                         'message': f'✅ 语音触发的设备操作完成: {device.get("name")} - {action_name}',
-                        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                        'timestamp': _now_timestamp()
                     })
                 else:
                     add_log_to_queue({
                         'type': 'error',
                         'message': f'❌ 语音触发的设备操作失败: {device.get("name")} - {action_name} (返回码: {process.returncode})',
-                        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                        'timestamp': _now_timestamp()
                     })
             except Exception as e:
                 add_log_to_queue({
                     'type': 'error',
                     'message': f'❌ 执行过程出错: {str(e)}',
-                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                    'timestamp': _now_timestamp()
                 })
         
         threading.Thread(target=wait_process, daemon=True).start()
@@ -475,14 +660,36 @@ def execute_device_action_internal(device_id, action_id):
     except Exception as e:
         return {"status": "error", "message": f"执行出错: {str(e)}"}
 
+def dispatch_voice_message(message):
+    """AI 匹配交给线程池并发处理，设备操作按语音到达顺序依次执行
+
+    先说"开灯"再说"关灯"时，即使"关灯"命中缓存先匹配完成，也要等"开灯"执行后再执行。
+    """
+    match_future = _voice_executor.submit(on_voice_message, message)
+    future = _voice_action_executor.submit(_run_voice_action, message.text, match_future)
+    future.add_done_callback(_log_voice_handler_error)
+
+def _run_voice_action(voice_text, match_future):
+    """等待 AI 匹配结果并执行设备操作（在单线程执行器中按提交顺序运行）"""
+    matched = match_future.result()
+    if matched is not None:
+        timestamp, command_match = matched
+        _execute_voice_match(voice_text, timestamp, command_match)
+
+def _log_voice_handler_error(future):
+    """打印语音消息处理线程中未捕获的异常"""
+    error = future.exception()
+    if error is not None:
+        print(f"❌ 处理语音消息失败: {error}")
+        traceback.print_exception(type(error), error, error.__traceback__)
+
 def on_voice_message(message):
-    """收到语音消息时的回调函数"""
+    """收到语音消息时的回调函数：记录日志并使用 AI 匹配设备操作，返回 (收到时间, 匹配结果)"""
     if not MI_MODULE_AVAILABLE:
         print("⚠️ MI_MODULE_AVAILABLE 为 False，无法处理语音消息")
-        return
+        return None
     
-    import time
-    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+    timestamp = _now_timestamp()
     
     voice_text = message.text
     print(f"🎤 收到语音: {voice_text}")
@@ -496,8 +703,10 @@ def on_voice_message(message):
     })
     
     # 使用 AI 解析语音命令
-    command_match = parse_voice_command_with_ai(voice_text)
-    
+    return timestamp, parse_voice_command_with_ai(voice_text)
+
+def _execute_voice_match(voice_text, timestamp, command_match):
+    """执行语音命令匹配到的设备操作，未匹配时记录警告"""
     if command_match:
         device_name = command_match['device_name']
         action_name = command_match['action_name']
@@ -548,10 +757,11 @@ def execute_device(device_id):
     """执行设备命令（流式输出）"""
     def generate():
         try:
-            device = get_device_by_id(device_id)
-            if not device:
-                yield f"data: {json.dumps({'type': 'error', 'message': f'设备 ID {device_id} 不存在'}, ensure_ascii=False)}\n\n"
+            entry = get_device_with_actions(device_id)
+            if not entry:
+                yield _sse_event({'type': 'error', 'message': f'设备 ID {device_id} 不存在'})
                 return
+            device, actions = entry
             
             # 获取请求参数
             request_data = request.get_json() or {}
@@ -566,21 +776,20 @@ def execute_device(device_id):
             app_name = device.get('app', '')
             
             # 如果指定了 action_id，从 actions 中查找对应的命令
-            if action_id and device.get('actions'):
-                for action in device.get('actions', []):
-                    if action.get('id') == action_id:
-                        action_command = action.get('command', '')
-                        # 将 action.command 中的 {app} 替换为实际的应用名称
-                        if action_command and app_name:
-                            command_text = action_command.replace('{app}', app_name)
-                        else:
-                            command_text = action_command
-                        final_command = command_text
-                        action_name = action.get('name', action_id)
-                        break
+            if action_id and actions:
+                action = actions.get(action_id)
+                if action:
+                    action_command = action.get('command', '')
+                    # 将 action.command 中的 {app} 替换为实际的应用名称
+                    if action_command and app_name:
+                        command_text = action_command.replace('{app}', app_name)
+                    else:
+                        command_text = action_command
+                    final_command = command_text
+                    action_name = action.get('name', action_id)
             else:
                 # 如果没有指定 action_id，返回错误
-                yield f"data: {json.dumps({'type': 'error', 'message': '未指定操作'}, ensure_ascii=False)}\n\n"
+                yield _sse_event({'type': 'error', 'message': '未指定操作'})
                 return
             
             # 检查必要的环境变量
@@ -606,7 +815,7 @@ def execute_device(device_id):
             
             # 发送开始消息
             device_name = device.get('name', '未知设备')
-            yield f"data: {json.dumps({'type': 'start', 'message': f'开始执行: {device_name} - {action_name}', 'command': ' '.join(cmd), 'final_command': final_command}, ensure_ascii=False)}\n\n"
+            yield _sse_event({'type': 'start', 'message': f'开始执行: {device_name} - {action_name}', 'command': ' '.join(cmd), 'final_command': final_command})
             
             # 设置环境变量，确保 Python 输出无缓冲
             env = os.environ.copy()
@@ -619,20 +828,16 @@ def execute_device(device_id):
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 text=True,
-                bufsize=0,  # 无缓冲
-                universal_newlines=True,
+                bufsize=1,  # 行缓冲（文本模式不支持无缓冲）
                 env=env
             )
             
             # 实时读取输出
             try:
-                while True:
-                    line = process.stdout.readline()
-                    if not line and process.poll() is not None:
-                        break
-                    if line:
-                        # 发送每一行输出
-                        yield f"data: {json.dumps({'type': 'output', 'line': line.rstrip()}, ensure_ascii=False)}\n\n"
+                # 读到 EOF 即表示进程已关闭输出
+                for line in iter(process.stdout.readline, ''):
+                    # 发送每一行输出
+                    yield _sse_event({'type': 'output', 'line': line.rstrip()})
             finally:
                 # 确保进程结束
                 if process.poll() is None:
@@ -640,53 +845,70 @@ def execute_device(device_id):
             
             # 发送结束消息
             if process.returncode == 0:
-                yield f"data: {json.dumps({'type': 'end', 'status': 'success', 'message': '命令执行完成', 'returncode': process.returncode}, ensure_ascii=False)}\n\n"
+                yield _sse_event({'type': 'end', 'status': 'success', 'message': '命令执行完成', 'returncode': process.returncode})
             else:
-                yield f"data: {json.dumps({'type': 'end', 'status': 'error', 'message': '命令执行失败', 'returncode': process.returncode}, ensure_ascii=False)}\n\n"
+                yield _sse_event({'type': 'end', 'status': 'error', 'message': '命令执行失败', 'returncode': process.returncode})
                 
         except FileNotFoundError:
             file_path = cmd[1] if len(cmd) > 1 else "未知"
             error_msg = f"文件路径: {file_path}"
-            yield f"data: {json.dumps({'type': 'error', 'message': '找不到 main.py 文件', 'error': error_msg}, ensure_ascii=False)}\n\n"
+            yield _sse_event({'type': 'error', 'message': '找不到 main.py 文件', 'error': error_msg})
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': '执行出错', 'error': str(e)}, ensure_ascii=False)}\n\n"
+            yield _sse_event({'type': 'error', 'message': '执行出错', 'error': str(e)})
     
     return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
+# mi/config.py 模块缓存（按文件修改时间失效）
+_MI_CONFIG_CACHE = {"mtime": None, "mod": None}
+
+def _load_mi_config():
+    """加载 mi/config.py（文件未变化时复用已加载的模块）"""
+    mtime = os.stat(MI_CONFIG_FILE).st_mtime_ns
+    if _MI_CONFIG_CACHE["mtime"] == mtime:
+        return _MI_CONFIG_CACHE["mod"]
+    
+    spec = importlib.util.spec_from_file_location("mi_config", MI_CONFIG_FILE)
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    
+    _MI_CONFIG_CACHE["mtime"] = mtime
+    _MI_CONFIG_CACHE["mod"] = config
+    return config
+
 def _start_voice_receiver_internal():
-    """内部启动语音接收器函数（不返回HTTP响应）"""
+    """内部启动语音接收器函数（不返回HTTP响应）
+
+    Returns:
+        (HTTP 状态码, 结果说明)：启动成功为 200，已在运行或配置错误为 400，启动出错为 500
+    """
     global voice_receiver
     
     if not MI_MODULE_AVAILABLE:
         print("⚠️ 小米音箱模块未安装或配置错误，跳过语音接收器启动")
-        return False
+        return 400, "小米音箱模块未安装或配置错误"
     
     with voice_receiver_lock:
         if voice_receiver and voice_receiver.is_running:
             print("ℹ️ 语音接收器已在运行中")
-            return True
+            return 400, "语音接收器已在运行中"
         
         try:
             # 检查配置文件是否存在
             if not os.path.exists(MI_CONFIG_FILE):
                 print("⚠️ 未找到小米音箱配置文件，跳过语音接收器启动")
-                return False
+                return 400, "未找到小米音箱配置文件"
             
             # 导入配置
-            import importlib.util
-            import time
-            spec = importlib.util.spec_from_file_location("mi_config", MI_CONFIG_FILE)
-            config = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(config)
+            config = _load_mi_config()
             
             # 检查配置
             if not hasattr(config, "USER_ID") or config.USER_ID == "你的小米ID":
                 print("⚠️ 未配置 USER_ID，跳过语音接收器启动")
-                return False
+                return 400, "未配置 USER_ID"
             
             if not hasattr(config, "DEVICE_NAME") or config.DEVICE_NAME == "你的音箱名称":
                 print("⚠️ 未配置 DEVICE_NAME，跳过语音接收器启动")
-                return False
+                return 400, "未配置 DEVICE_NAME"
             
             # 创建账号管理器
             account_manager = AccountManager()
@@ -706,7 +928,7 @@ def _start_voice_receiver_internal():
             add_log_to_queue({
                 'type': 'info',
                 'message': f'🔐 正在登录小米账号...',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                'timestamp': _now_timestamp()
             })
             
             account = account_manager.get_account(account)
@@ -716,15 +938,15 @@ def _start_voice_receiver_internal():
                 add_log_to_queue({
                     'type': 'error',
                     'message': f'❌ {error_msg}',
-                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                    'timestamp': _now_timestamp()
                 })
-                return False
+                return 400, error_msg
             
             print(f"✅ 登录成功")
             add_log_to_queue({
                 'type': 'success',
                 'message': f'✅ 小米账号登录成功',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                'timestamp': _now_timestamp()
             })
             
             # 创建 MiNA 实例
@@ -739,7 +961,7 @@ def _start_voice_receiver_internal():
             add_log_to_queue({
                 'type': 'info',
                 'message': f'🔧 正在启动语音接收器...',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                'timestamp': _now_timestamp()
             })
             
             # 开始监听
@@ -752,11 +974,11 @@ def _start_voice_receiver_internal():
             add_log_to_queue({
                 'type': 'info',
                 'message': f'📡 配置信息 - 设备: {config.DEVICE_NAME}, 轮询间隔: {poll_interval}ms',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                'timestamp': _now_timestamp()
             })
             
             voice_receiver.start(
-                callback=on_voice_message,
+                callback=dispatch_voice_message,
                 interval=poll_interval,
                 only_new=True,
             )
@@ -765,148 +987,25 @@ def _start_voice_receiver_internal():
             add_log_to_queue({
                 'type': 'success',
                 'message': f'✅ 语音接收器已启动，正在监听设备: {config.DEVICE_NAME}',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                'timestamp': _now_timestamp()
             })
             
             print(f"✅ 语音接收器启动成功")
-            return True
+            return 200, "语音接收器已启动"
             
         except Exception as e:
             print(f"❌ 启动语音接收器失败: {str(e)}")
-            import traceback
             traceback.print_exc()
-            return False
+            return 500, f"启动语音接收器失败: {str(e)}"
 
 @app.route('/api/voice/start', methods=['POST'])
 def start_voice_receiver():
     """启动语音接收器（API端点）"""
-    global voice_receiver
-    
-    if not MI_MODULE_AVAILABLE:
-        return jsonify({
-            "status": "error",
-            "message": "小米音箱模块未安装或配置错误"
-        }), 400
-    
-    with voice_receiver_lock:
-        if voice_receiver and voice_receiver.is_running:
-            return jsonify({
-                "status": "error",
-                "message": "语音接收器已在运行中"
-            }), 400
-        
-        try:
-            # 检查配置文件是否存在
-            if not os.path.exists(MI_CONFIG_FILE):
-                print("⚠️ 未找到小米音箱配置文件，跳过语音接收器启动")
-                return False
-            
-            # 导入配置
-            import importlib.util
-            import time
-            spec = importlib.util.spec_from_file_location("mi_config", MI_CONFIG_FILE)
-            config = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(config)
-            
-            # 检查配置
-            if not hasattr(config, "USER_ID") or config.USER_ID == "你的小米ID":
-                print("⚠️ 未配置 USER_ID，跳过语音接收器启动")
-                return False
-            
-            if not hasattr(config, "DEVICE_NAME") or config.DEVICE_NAME == "你的音箱名称":
-                print("⚠️ 未配置 DEVICE_NAME，跳过语音接收器启动")
-                return False
-            
-            # 创建账号管理器
-            account_manager = AccountManager()
-            
-            # 创建账号对象
-            account = MiAccount(
-                sid="micoapi",
-                device_id=f"android_{os.urandom(5).hex()}",
-                user_id=config.USER_ID,
-                password=getattr(config, "PASSWORD", None),
-                pass_token=getattr(config, "PASS_TOKEN", None),
-                did=config.DEVICE_NAME,
-            )
-            
-            # 登录
-            print(f"🔐 正在登录小米账号...")
-            add_log_to_queue({
-                'type': 'info',
-                'message': f'🔐 正在登录小米账号...',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-            })
-            
-            account = account_manager.get_account(account)
-            if not account:
-                error_msg = "登录失败，请检查账号信息"
-                print(f"❌ {error_msg}")
-                add_log_to_queue({
-                    'type': 'error',
-                    'message': f'❌ {error_msg}',
-                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-                })
-                return False
-            
-            print(f"✅ 登录成功")
-            add_log_to_queue({
-                'type': 'success',
-                'message': f'✅ 小米账号登录成功',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-            })
-            
-            # 创建 MiNA 实例
-            print(f"📱 创建 MiNA 实例...")
-            mina = MiNA(account)
-            print(f"✅ MiNA 实例创建成功")
-            
-            # 创建语音接收器
-            voice_receiver = VoiceReceiver(mina)
-            
-            # 添加启动日志
-            add_log_to_queue({
-                'type': 'info',
-                'message': f'🔧 正在启动语音接收器...',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-            })
-            
-            # 开始监听
-            poll_interval = getattr(config, "POLL_INTERVAL", 1000)
-            print(f"📡 启动语音接收器，轮询间隔: {poll_interval}ms")
-            print(f"📡 设备名称: {config.DEVICE_NAME}")
-            print(f"📡 用户ID: {config.USER_ID}")
-            
-            # 添加调试信息到日志
-            add_log_to_queue({
-                'type': 'info',
-                'message': f'📡 配置信息 - 设备: {config.DEVICE_NAME}, 轮询间隔: {poll_interval}ms',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-            })
-            
-            voice_receiver.start(
-                callback=on_voice_message,
-                interval=poll_interval,
-                only_new=True,
-            )
-            
-            # 添加启动成功日志
-            add_log_to_queue({
-                'type': 'success',
-                'message': f'✅ 语音接收器已启动，正在监听设备: {config.DEVICE_NAME}',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-            })
-            
-            return jsonify({
-                "status": "success",
-                "message": "语音接收器已启动"
-            })
-            
-        except Exception as e:
-            return jsonify({
-                "status": "error",
-                "message": f"启动语音接收器失败: {str(e)}"
-            }), 500
+    status_code, message = _start_voice_receiver_internal()
+    return jsonify({
+        "status": "success" if status_code == 200 else "error",
+        "message": message
+    }), status_code
 
 @app.route('/api/voice/stop', methods=['POST'])
 def stop_voice_receiver():
@@ -955,45 +1054,66 @@ def get_voice_status():
             "message": "语音接收器运行中" if is_running else "语音接收器未运行"
         })
 
-@app.route('/api/logs/stream', methods=['GET'])
-def stream_logs():
-    """流式推送日志（Server-Sent Events）"""
-    import queue
-    import time
+def _generate_logs(heartbeat):
+    """日志流生成器：先推送最近的历史日志，再持续推送新日志"""
+    # 记录当前日志序号，同时获取历史日志（最近 LOG_HISTORY_SIZE 条）快照
+    with log_cv:
+        last_seq = log_seq
+        recent_logs = tuple(itertools.islice(
+            log_queue, max(0, len(log_queue) - LOG_HISTORY_SIZE), None))
     
-    def generate():
-        # 创建一个队列用于接收日志
-        log_queue_local = queue.Queue()
+    # 连接消息和历史日志拼接后一次性推送（锁外拼接，避免阻塞日志生产者）
+    yield _SSE_CONNECTED_FRAME + b"".join(recent_logs)
+    
+    # 持续监听新日志
+    while True:
+        with log_cv:
+            # 等待新日志，超时则发送心跳
+            if log_cv.wait_for(lambda: log_seq != last_seq, timeout=heartbeat):
+                # 短暂等待后续日志，凑成一批再推送
+                log_cv.wait_for(lambda: log_seq - last_seq >= SSE_BATCH_SIZE,
+                                timeout=SSE_COALESCE_DELAY)
+                new_logs = _read_new_logs(last_seq)
+                last_seq = log_seq
+            else:
+                new_logs = None
         
-        # 添加到监听器集合
-        with log_queue_lock:
-            log_listeners.add(log_queue_local)
+        if new_logs is None:
+            # 发送心跳保持连接
+            yield _sse_event({'type': 'heartbeat', 'timestamp': time.time()})
+            continue
         
+        # 多条日志帧拼接后一次性推送
+        for i in range(0, len(new_logs), SSE_BATCH_SIZE):
+            yield b"".join(new_logs[i:i + SSE_BATCH_SIZE])
+
+@app.route('/api/logs/stream', methods=['GET'])
+def stream_logs():
+    """流式推送日志（Server-Sent Events）
+
+    可通过 ?heartbeat=秒数 调整心跳间隔（1~60 秒），适配空闲超时更短的代理
+    """
+    try:
+        heartbeat = float(request.args.get('heartbeat', SSE_HEARTBEAT_INTERVAL))
+        heartbeat = min(max(heartbeat, 1), 60)
+    except ValueError:
+        heartbeat = SSE_HEARTBEAT_INTERVAL
+    
+    return Response(stream_with_context(_generate_logs(heartbeat)), mimetype='text/event-stream')
+
+def _warm_up():
+    """预热智谱 API 连接（DNS + TLS）和 mi/config.py 模块缓存"""
+    if ZHIPU_API_KEY:
         try:
-            # 发送初始消息
-            yield f"data: {json.dumps({'type': 'connected', 'message': '日志流已连接'}, ensure_ascii=False)}\n\n"
-            
-            # 发送历史日志（最近20条）
-            with log_queue_lock:
-                recent_logs = log_queue[-20:] if len(log_queue) > 20 else log_queue
-                for log_data in recent_logs:
-                    yield f"data: {json.dumps(log_data, ensure_ascii=False)}\n\n"
-            
-            # 持续监听新日志
-            while True:
-                try:
-                    # 等待新日志，超时1秒
-                    log_data = log_queue_local.get(timeout=1)
-                    yield f"data: {json.dumps(log_data, ensure_ascii=False)}\n\n"
-                except queue.Empty:
-                    # 发送心跳保持连接
-                    yield f"data: {json.dumps({'type': 'heartbeat', 'timestamp': time.time()}, ensure_ascii=False)}\n\n"
-        finally:
-            # 移除监听器
-            with log_queue_lock:
-                log_listeners.discard(log_queue_local)
+            _ZHIPU_SESSION.get(ZHIPU_API_BASE_URL, timeout=2)
+        except Exception as e:
+            print(f"⚠️ 预热智谱 API 连接失败: {e}")
     
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    if MI_MODULE_AVAILABLE and os.path.exists(MI_CONFIG_FILE):
+        try:
+            _load_mi_config()
+        except Exception as e:
+            print(f"⚠️ 预加载 mi/config.py 失败: {e}")
 
 # ==================== 注册模块路由 ====================
 
@@ -1004,7 +1124,7 @@ register_device_routes(app)
 import scheduler
 scheduler.execute_device_action_callback = execute_device_action_internal
 scheduler.add_log_to_queue_callback = add_log_to_queue
-scheduler.get_device_by_id_callback = get_device_by_id
+scheduler.iter_devices_by_ids_callback = iter_devices_by_ids
 
 # 注册定时任务路由
 register_schedule_routes(app)
@@ -1028,10 +1148,7 @@ if __name__ == '__main__':
         # 检查配置文件是否存在
         if os.path.exists(MI_CONFIG_FILE):
             try:
-                import importlib.util
-                spec = importlib.util.spec_from_file_location("mi_config", MI_CONFIG_FILE)
-                config = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(config)
+                config = _load_mi_config()
                 
                 user_id = getattr(config, "USER_ID", None)
                 device_name = getattr(config, "DEVICE_NAME", None)
@@ -1057,6 +1174,9 @@ if __name__ == '__main__':
     print("🚀 正在启动定时任务调度器...")
     start_scheduler()
     
+    # 后台预热：提前建立智谱 API 连接、加载 mi/config.py，让第一次请求不必等待
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+    
     print()
     print("=" * 60)
     print("服务器启动中...")
@@ -2,32 +2,65 @@
 设备管理模块
 处理设备的增删改查操作
 """
-import json
+import copy
 import os
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
+
+from json_store import JsonFileCache, dumps_bytes
 
 # 设备配置文件路径
 base_dir = os.path.dirname(os.path.abspath(__file__))
 DEVICES_CONFIG_FILE = os.path.join(base_dir, 'datas', 'devices.json')
 
 
+def _build_cache(devices, mtime):
+    """由设备列表构建缓存：按 ID 索引设备、位置和操作"""
+    by_id = {}
+    index = {}
+    actions = {}
+    for i, device in enumerate(devices):
+        if not isinstance(device, dict):
+            continue
+        # ID 重复时以第一个为准
+        if device.get('id') not in by_id:
+            by_id[device.get('id')] = device
+            index[device.get('id')] = i
+            # actions 可能为 null 或含有非对象条目，跳过无效项
+            actions[device.get('id')] = (
+                device,
+                {action.get('id'): action for action in device.get('actions') or []
+                 if isinstance(action, dict)}
+            )
+    return {
+        "mtime": mtime,
+        "devices": devices,
+        "by_id": by_id,
+        "index": index,
+        "actions": actions
+    }
+
+
+# 设备配置内存缓存，按 devices.json 的修改时间失效
+_store = JsonFileCache(DEVICES_CONFIG_FILE, "设备配置", _build_cache)
+
+
+def _load_cached():
+    """获取设备配置缓存（返回的数据是共享的，调用方不能修改）"""
+    return _store.get()
+
+
 def load_devices():
-    """加载设备配置"""
-    try:
-        if os.path.exists(DEVICES_CONFIG_FILE):
-            with open(DEVICES_CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
-    except Exception as e:
-        print(f"加载设备配置失败: {e}")
-        return []
+    """加载设备配置（返回副本，调用方可以直接修改后保存）"""
+    return copy.deepcopy(_load_cached()["devices"])
 
 
 def save_devices(devices):
-    """保存设备配置"""
+    """保存设备配置（内容与当前配置相同时不写盘）"""
     try:
-        with open(DEVICES_CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(devices, f, ensure_ascii=False, indent=2)
+        cache = _load_cached()
+        if cache["mtime"] is not None and devices == cache["devices"]:
+            return True
+        _store.save(devices)
         return True
     except Exception as e:
         print(f"保存设备配置失败: {e}")
@@ -35,12 +68,27 @@ def save_devices(devices):
 
 
 def get_device_by_id(device_id):
-    """根据 ID 获取设备"""
-    devices = load_devices()
-    for device in devices:
-        if device.get('id') == device_id:
-            return device
-    return None
+    """根据 ID 获取设备（返回缓存中的设备，调用方不能修改）"""
+    return _load_cached()["by_id"].get(device_id)
+
+
+def get_device_with_actions(device_id):
+    """根据 ID 获取 (设备, {操作 ID: 操作})，设备不存在时返回 None（返回缓存中的数据，调用方不能修改）"""
+    return _load_cached()["actions"].get(device_id)
+
+
+def get_devices_snapshot():
+    """获取设备配置缓存（mtime / devices / by_id / actions 属于同一版本，调用方不能修改）"""
+    return _load_cached()
+
+
+def iter_devices_by_ids(device_ids):
+    """按 ID 批量获取设备，跳过不存在的 ID（返回缓存中的设备，调用方不能修改）"""
+    by_id = _load_cached()["by_id"]
+    for device_id in device_ids:
+        device = by_id.get(device_id)
+        if device is not None:
+            yield device
 
 
 def register_device_routes(app):
@@ -50,7 +98,7 @@ def register_device_routes(app):
     def get_devices():
         """获取所有设备配置"""
         try:
-            devices = load_devices()
+            devices = _load_cached()["devices"]
             return jsonify({
                 "status": "success",
                 "devices": devices
@@ -61,12 +109,24 @@ def register_device_routes(app):
                 "message": str(e)
             }), 400
 
+    @app.route('/api/devices/stream', methods=['GET'])
+    def stream_devices():
+        """以 NDJSON 格式流式返回所有设备配置（每行一个设备）"""
+        devices = _load_cached()["devices"]
+        
+        def generate():
+            for device in devices:
+                yield dumps_bytes(device) + b'\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
     @app.route('/api/devices', methods=['POST'])
     def add_device():
         """添加新设备"""
         try:
             data = request.get_json()
-            devices = load_devices()
+            cache = _load_cached()
+            devices = copy.deepcopy(cache["devices"])
             
             # 生成新设备 ID
             if 'id' not in data or not data['id']:
@@ -75,7 +135,7 @@ def register_device_routes(app):
                 device_id = data['id']
             
             # 检查 ID 是否已存在
-            if any(d.get('id') == device_id for d in devices):
+            if device_id in cache["by_id"]:
                 return jsonify({
                     "status": "error",
                     "message": f"设备 ID '{device_id}' 已存在"
@@ -115,20 +175,17 @@ def register_device_routes(app):
         """更新设备配置"""
         try:
             data = request.get_json()
-            devices = load_devices()
-            
-            device_index = None
-            for i, device in enumerate(devices):
-                if device.get('id') == device_id:
-                    device_index = i
-                    break
+            cache = _load_cached()
             
+            device_index = cache["index"].get(device_id)
             if device_index is None:
                 return jsonify({
                     "status": "error",
                     "message": f"设备 ID '{device_id}' 不存在"
                 }), 404
             
+            devices = copy.deepcopy(cache["devices"])
+            
             # 更新设备信息
             update_data = {
                 "name": data.get('name', devices[device_index].get('name')),
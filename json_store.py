@@ -0,0 +1,91 @@
+"""
+JSON 文件存储模块
+按修改时间缓存 datas/ 下的 JSON 配置文件，保存时原子写入
+"""
+import json
+import os
+import threading
+
+# orjson 序列化更快，未安装时回退到标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ["dumps_bytes", "loads", "JsonFileCache"]
+
+
+def dumps_bytes(obj, indent=False):
+    """序列化为 UTF-8 JSON 字节串（默认紧凑格式；indent 为 True 时缩进 2 格）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(s):
+    """解析 JSON 字符串或字节串，格式无效时抛出 ValueError"""
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+class JsonFileCache:
+    """JSON 文件的内存缓存
+
+    文件修改时间（st_mtime_ns）变化时才重新解析；解析结果经 build(data, mtime)
+    处理后整体替换缓存，读取方不会看到新旧数据混在一起。返回的数据是共享的，调用方不能修改。
+    """
+
+    def __init__(self, path, label, build=None):
+        self.path = path
+        self.label = label  # 用于错误日志，如 "设备配置"
+        self._build = build or (lambda data, mtime: data)
+        self._entry = (None, self._build([], None))  # (mtime, 缓存值)
+        self._save_lock = threading.Lock()
+
+    def _get_mtime(self):
+        """获取文件修改时间，文件不存在时返回 None"""
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self):
+        """从磁盘读取并解析 JSON，文件不存在或格式错误时返回空列表"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'rb') as f:
+                    return loads(f.read())
+            return []
+        except Exception as e:
+            print(f"加载{self.label}失败: {e}")
+            return []
+
+    def get(self):
+        """获取缓存值，文件变化时重新解析"""
+        entry = self._entry
+        mtime = self._get_mtime()
+        if mtime is None or mtime != entry[0]:
+            entry = (mtime, self._build(self._read(), mtime))
+            self._entry = entry
+        return entry[1]
+
+    def save(self, data):
+        """保存数据并更新缓存（先写临时文件再原子替换，写入中途崩溃也不会留下不完整的 JSON）"""
+        content = dumps_bytes(data, indent=True)
+        tmp_file = self.path + '.tmp'
+        with self._save_lock:
+            with open(tmp_file, 'wb') as f:
+                f.write(content)
+            try:
+                # 替换前先构建缓存：构建失败时原文件和缓存都保持不变
+                # os.replace 保留临时文件的修改时间，可直接作为缓存的 mtime
+                mtime = os.stat(tmp_file).st_mtime_ns
+                value = self._build(data, mtime)
+            except Exception:
+                os.remove(tmp_file)
+                raise
+            os.replace(tmp_file, self.path)
+            self._entry = (mtime, value)
@@ -1,14 +1,41 @@
 """
 账号认证模块
 """
-import json
 import os
-from typing import Any, Dict, Optional
+import threading
+from typing import Any, Dict, Optional, Tuple
 
 try:
-    from .utils import CodecUtils, HashUtils, HttpClient
+    from .utils import CodecUtils, HashUtils, HttpClient, JsonUtils
 except ImportError:
-    from utils import CodecUtils, HashUtils, HttpClient
+    from utils import CodecUtils, HashUtils, HttpClient, JsonUtils
+
+# 按配置文件路径共享的账号信息和写锁：app.py 每次启动监听都会新建 AccountManager，
+# 同一文件的所有实例共用一份内存数据，文件只在首次使用时读取一次
+_CONFIG_STORES: Dict[str, Tuple[threading.Lock, Dict[str, Any]]] = {}
+_CONFIG_STORES_GUARD = threading.Lock()
+
+
+def _read_store(config_file: str) -> Dict[str, Any]:
+    """从文件读取已保存的账号信息"""
+    if not os.path.exists(config_file):
+        return {}
+    try:
+        with open(config_file, "rb") as f:
+            store = JsonUtils.loads(f.read())
+        return store if isinstance(store, dict) else {}
+    except Exception:
+        return {}
+
+
+def _get_config_store(config_file: str) -> Tuple[threading.Lock, Dict[str, Any]]:
+    """获取配置文件对应的 (写锁, 账号信息)"""
+    key = os.path.abspath(config_file)
+    with _CONFIG_STORES_GUARD:
+        entry = _CONFIG_STORES.get(key)
+        if entry is None:
+            entry = _CONFIG_STORES[key] = (threading.Lock(), _read_store(key))
+        return entry
 
 
 class MiAccount:
@@ -41,17 +68,18 @@ class AccountManager:
         self.config_file = config_file
         self.http = HttpClient()
         self.login_api = "https://account.xiaomi.com/pass"
+        # 已保存的账号信息按文件在模块级共享，只在首次使用时读取一次
+        self._lock, self._store = _get_config_store(config_file)
 
     def _get_login_cookies(self, account: MiAccount) -> Dict[str, str]:
         """获取登录 cookies"""
-        cookies = {}
-        if account.user_id:
-            cookies["userId"] = account.user_id
-        if account.device_id:
-            cookies["deviceId"] = account.device_id
-        if account.pass_token:
-            cookies["passToken"] = account.pass_token
-        return cookies
+        return HttpClient.cookies_from(
+            [
+                ("userId", account.user_id),
+                ("deviceId", account.device_id),
+                ("passToken", account.pass_token),
+            ]
+        )
 
     def _get_service_token(self, pass_data: Dict[str, Any]) -> Optional[str]:
         """获取服务 token"""
@@ -62,23 +90,20 @@ class AccountManager:
         if not location or not nonce or not ssecurity:
             return None
 
-        client_sign = HashUtils.sha1(f"nonce={nonce}&{ssecurity}")
+        client_sign = HashUtils.sha1(b"nonce=" + str(nonce).encode() + b"&" + ssecurity.encode())
         response = self.http.get(
             location,
             params={"_userIdNeedEncrypt": "true", "clientSign": client_sign},
             raw_response=True,
         )
 
-        if hasattr(response, "headers"):
-            cookies = response.headers.get("Set-Cookie", "")
-            if isinstance(cookies, str):
-                for cookie in cookies.split(","):
-                    if "serviceToken" in cookie:
-                        return cookie.split(";")[0].split("=")[1]
-            elif isinstance(cookies, list):
-                for cookie in cookies:
-                    if "serviceToken" in cookie:
-                        return cookie.split(";")[0].split("=")[1]
+        # raw_response=True 时返回 requests.Response，请求失败时返回错误字典
+        if hasattr(response, "cookies"):
+            # serviceToken 可能在跳转过程中的某个响应里下发
+            for r in [*response.history, response]:
+                for cookie in r.cookies:
+                    if cookie.name == "serviceToken" and cookie.value:
+                        return cookie.value
 
         print("❌ 获取 Mi Service Token 失败")
         return None
@@ -89,20 +114,15 @@ class AccountManager:
         relogin: bool = False,
     ) -> Optional[MiAccount]:
         """获取账号信息（登录）"""
-        # 从文件读取已保存的账号信息
-        if not relogin and os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, "r", encoding="utf-8") as f:
-                    store = json.load(f)
-                    service_key = account.sid
-                    if service_key in store:
-                        saved_account = store[service_key]
-                        account.pass_token = saved_account.get("passToken")
-                        account.service_token = saved_account.get("serviceToken")
-                        account.pass_data = saved_account.get("pass")
-                        account.device = saved_account.get("device")
-            except:
-                pass
+        # 读取已保存的账号信息
+        if not relogin:
+            with self._lock:
+                saved_account = self._store.get(account.sid)
+            if isinstance(saved_account, dict):
+                account.pass_token = saved_account.get("passToken")
+                account.service_token = saved_account.get("serviceToken")
+                account.pass_data = saved_account.get("pass")
+                account.device = saved_account.get("device")
 
         # 如果没有 passToken 且没有 userId/password，返回 None
         if not account.pass_token and (not account.user_id or not account.password):
@@ -191,23 +211,21 @@ class AccountManager:
     def _save_account(self, account: MiAccount):
         """保存账号信息到文件"""
         try:
-            store = {}
-            if os.path.exists(self.config_file):
-                with open(self.config_file, "r", encoding="utf-8") as f:
-                    store = json.load(f)
-
-            service_key = account.sid
-            store[service_key] = {
-                "deviceId": account.device_id,
-                "userId": account.user_id,
-                "passToken": account.pass_token,
-                "serviceToken": account.service_token,
-                "pass": account.pass_data,
-                "device": account.device,
-            }
-
-            with open(self.config_file, "w", encoding="utf-8") as f:
-                json.dump(store, f, ensure_ascii=False, indent=2)
+            with self._lock:
+                self._store[account.sid] = {
+                    "deviceId": account.device_id,
+                    "userId": account.user_id,
+                    "passToken": account.pass_token,
+                    "serviceToken": account.service_token,
+                    "pass": account.pass_data,
+                    "device": account.device,
+                }
+                content = JsonUtils.dumps(self._store, indent=True)
+
+                # 先写临时文件再替换，避免写入中途出错导致配置文件损坏
+                tmp_file = self.config_file + ".tmp"
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.replace(tmp_file, self.config_file)
         except Exception as e:
             print(f"⚠️ 保存账号信息失败: {e}")
-
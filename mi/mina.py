@@ -1,25 +1,43 @@
 """
 MiNA (小米小爱) 模块
 """
-import json
 import time
 from typing import Any, Dict, List, Optional
 
 try:
     from .account import MiAccount
-    from .utils import CodecUtils, HashUtils, HttpClient
+    from .utils import CodecUtils, HashUtils, HttpClient, JsonUtils
 except ImportError:
     from account import MiAccount
-    from utils import CodecUtils, HashUtils, HttpClient
+    from utils import CodecUtils, HashUtils, HttpClient, JsonUtils
 
 
 class MiNA:
     """MiNA 类，用于与小爱音箱交互"""
 
+    # 固定不变的请求头，所有请求共用
+    MINA_HEADERS = {
+        "User-Agent": "MICO/AndroidApp/@SHIP.TO.2A2FE0D7@/2.4.40",
+    }
+    CONVERSATION_HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Linux; Android 10; 000; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/119.0.6045.193 Mobile Safari/537.36 /XiaoMi/HybridView/ micoSoundboxApp/i appVersion/A_2.4.40",
+        "Referer": "https://userprofile.mina.mi.com/dialogue-note/index.html",
+    }
+
+    # MiNA 接口路径，初始化时拼接成完整 URL
+    DEVICE_LIST_PATH = "/admin/v2/device_list"
+    UBUS_PATH = "/remote/ubus"
+    _PATHS = (DEVICE_LIST_PATH, UBUS_PATH)
+    CONVERSATION_URL = "https://userprofile.mina.mi.com/device_profile/v2/conversation"
+
     def __init__(self, account: MiAccount):
         self.account = account
         self.http = HttpClient()
         self.base_url = "https://api2.mina.mi.com"
+        self._urls = {path: self.base_url + path for path in self._PATHS}
+        self._cookies_key: Optional[tuple] = None
+        self._cookies_cache: Dict[str, str] = {}
+        self._conversation_cookies_cache: Dict[str, str] = {}
 
     @staticmethod
     def get_device(account: MiAccount) -> MiAccount:
@@ -28,7 +46,7 @@ class MiNA:
             return account
 
         mina = MiNA(account)
-        devices = mina._call_mina("GET", "/admin/v2/device_list")
+        devices = mina._call_mina("GET", MiNA.DEVICE_LIST_PATH, {})
 
         if devices:
             device = None
@@ -54,36 +72,68 @@ class MiNA:
 
         return account
 
+    def _refresh_cookies(self):
+        """账号信息（userId / serviceToken / 设备）变化时重新构建 cookies，否则复用"""
+        account = self.account
+        device = account.device or {}
+        # 以实际参与构建 cookies 的值作为缓存键，设备信息原地修改或替换都能感知
+        key = (
+            account.user_id,
+            account.service_token,
+            device.get("serialNumber"),
+            device.get("hardware"),
+            device.get("deviceId"),
+            device.get("deviceSNProfile"),
+        )
+        if key == self._cookies_key:
+            return
+
+        cookies = HttpClient.cookies_from(
+            [
+                ("userId", account.user_id),
+                ("serviceToken", account.service_token),
+                ("sn", device.get("serialNumber")),
+                ("hardware", device.get("hardware")),
+                ("deviceId", device.get("deviceId")),
+                ("deviceSNProfile", device.get("deviceSNProfile")),
+            ]
+        )
+        conversation_cookies = HttpClient.cookies_from(
+            [
+                ("userId", account.user_id),
+                ("serviceToken", account.service_token),
+                ("deviceId", device.get("deviceId")),
+            ]
+        )
+
+        self._cookies_key = key
+        self._cookies_cache = cookies
+        self._conversation_cookies_cache = conversation_cookies
+
+    def _get_mina_cookies(self) -> Dict[str, str]:
+        """获取 MiNA 请求的 cookies"""
+        self._refresh_cookies()
+        return self._cookies_cache
+
+    def _get_conversation_cookies(self) -> Dict[str, str]:
+        """获取对话记录请求的 cookies"""
+        self._refresh_cookies()
+        return self._conversation_cookies_cache
+
     def _call_mina(
         self, method: str, path: str, data: Optional[Dict[str, Any]] = None
     ) -> Optional[Any]:
-        """调用 MiNA API"""
+        """调用 MiNA API（data 由调用方构建，这里直接写入 requestId / timestamp）"""
         if data is None:
             data = {}
 
         data["requestId"] = HashUtils.uuid()
         data["timestamp"] = int(time.time())
 
-        url = f"{self.base_url}{path}"
-
-        cookies = {}
-        if self.account.user_id:
-            cookies["userId"] = self.account.user_id
-        if self.account.service_token:
-            cookies["serviceToken"] = self.account.service_token
-        if self.account.device:
-            if self.account.device.get("serialNumber"):
-                cookies["sn"] = self.account.device.get("serialNumber")
-            if self.account.device.get("hardware"):
-                cookies["hardware"] = self.account.device.get("hardware")
-            if self.account.device.get("deviceId"):
-                cookies["deviceId"] = self.account.device.get("deviceId")
-            if self.account.device.get("deviceSNProfile"):
-                cookies["deviceSNProfile"] = self.account.device.get("deviceSNProfile")
-
-        headers = {
-            "User-Agent": "MICO/AndroidApp/@SHIP.TO.2A2FE0D7@/2.4.40",
-        }
+        url = self._urls.get(path) or self.base_url + path
+
+        cookies = self._get_mina_cookies()
+        headers = self.MINA_HEADERS
 
         try:
             if method == "GET":
@@ -93,23 +143,15 @@ class MiNA:
                     url, data=CodecUtils.encode_query(data), cookies=cookies, headers=headers
                 )
 
+            # HttpClient 请求失败时返回错误字典，成功时返回响应体字节串
             if isinstance(response, dict):
-                if response.get("code") == 0:
-                    return response.get("data")
-                else:
-                    print(f"❌ _call_mina failed: {response}")
-                    return None
-            else:
-                # 尝试解析 JSON
-                try:
-                    result = json.loads(response)
-                    if result.get("code") == 0:
-                        return result.get("data")
-                    else:
-                        print(f"❌ _call_mina failed: {result}")
-                        return None
-                except:
-                    return None
+                print(f"❌ _call_mina failed: {response}")
+                return None
+            result = JsonUtils.loads(response)
+            if result.get("code") == 0:
+                return result.get("data")
+            print(f"❌ _call_mina failed: {result}")
+            return None
         except Exception as e:
             print(f"❌ _call_mina error: {e}")
             return None
@@ -118,10 +160,10 @@ class MiNA:
         """调用小爱音箱上的 ubus 服务"""
         if message is None:
             message = {}
-        message_str = json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+        message_str = JsonUtils.dumps(message)
         return self._call_mina(
             "POST",
-            "/remote/ubus",
+            self.UBUS_PATH,
             {
                 "deviceId": self.account.device.get("deviceId") if self.account.device else "",
                 "path": scope,
@@ -132,14 +174,12 @@ class MiNA:
 
     def get_devices(self) -> Optional[List[Dict[str, Any]]]:
         """获取设备列表"""
-        return self._call_mina("GET", "/admin/v2/device_list")
+        return self._call_mina("GET", self.DEVICE_LIST_PATH, {})
 
     def get_conversations(
         self, limit: int = 10, timestamp: Optional[int] = None
     ) -> Optional[Dict[str, Any]]:
         """获取对话消息列表"""
-        url = "https://userprofile.mina.mi.com/device_profile/v2/conversation"
-
         params = {
             "limit": limit,
             "requestId": HashUtils.uuid(),
@@ -151,45 +191,26 @@ class MiNA:
         if timestamp:
             params["timestamp"] = timestamp
 
-        cookies = {}
-        if self.account.user_id:
-            cookies["userId"] = self.account.user_id
-        if self.account.service_token:
-            cookies["serviceToken"] = self.account.service_token
-        if self.account.device and self.account.device.get("deviceId"):
-            cookies["deviceId"] = self.account.device.get("deviceId")
-
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Linux; Android 10; 000; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/119.0.6045.193 Mobile Safari/537.36 /XiaoMi/HybridView/ micoSoundboxApp/i appVersion/A_2.4.40",
-            "Referer": "https://userprofile.mina.mi.com/dialogue-note/index.html",
-        }
+        cookies = self._get_conversation_cookies()
+        headers = self.CONVERSATION_HEADERS
 
         try:
-            response = self.http.get(url, params=params, cookies=cookies, headers=headers)
+            response = self.http.get(
+                self.CONVERSATION_URL, params=params, cookies=cookies, headers=headers
+            )
 
             if isinstance(response, dict):
-                if response.get("code") == 0:
-                    data_str = response.get("data")
-                    if isinstance(data_str, str):
-                        return json.loads(data_str)
-                    return data_str
-                else:
-                    print(f"❌ get_conversations failed: {response}")
-                    return None
-            else:
-                try:
-                    result = json.loads(response)
-                    if result.get("code") == 0:
-                        data_str = result.get("data")
-                        if isinstance(data_str, str):
-                            return json.loads(data_str)
-                        return data_str
-                    else:
-                        print(f"❌ get_conversations failed: {result}")
-                        return None
-                except Exception as e:
-                    print(f"❌ get_conversations parse error: {e}")
-                    return None
+                print(f"❌ get_conversations failed: {response}")
+                return None
+            result = JsonUtils.loads(response)
+            if result.get("code") != 0:
+                print(f"❌ get_conversations failed: {result}")
+                return None
+            # data 字段本身是 JSON 字符串
+            data = result.get("data")
+            if isinstance(data, str):
+                return JsonUtils.loads(data)
+            return data
         except Exception as e:
             print(f"❌ get_conversations error: {e}")
             return None
@@ -2,30 +2,124 @@
 工具函数模块
 """
 import base64
+import binascii
+import gzip as gzip_lib
 import hashlib
 import hmac
 import json
-import random
+import re
+import secrets
 import urllib.parse
-from typing import Any, Dict, Optional
+import uuid as uuid_lib
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple, Union
 
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# RC4 优先使用 PyCryptodome 的 C 实现，未安装时回退到纯 Python 实现
+try:
+    from Cryptodome.Cipher import ARC4 as _ARC4
+except ImportError:
+    try:
+        from Crypto.Cipher import ARC4 as _ARC4
+    except ImportError:
+        _ARC4 = None
+
+
+def _b64e(data: bytes) -> str:
+    """Base64 编码（直接调用 binascii，省去 base64 模块的包装开销）"""
+    return binascii.b2a_base64(data, newline=False).decode()
+
+
+_b64d = binascii.a2b_base64
+
+# 查询参数的键基本固定，编码结果可以缓存（值每次请求都不同，不做缓存）
+@lru_cache(maxsize=256)
+def _quote_key(key: str) -> str:
+    return urllib.parse.quote(key, safe="/")
+
+
+# 认证响应中的大整数（9 位以上），解析前转成字符串避免精度丢失
+_BIGNUM_RE = re.compile(rb":(\d{9,})")
+
+
+class JsonUtils:
+    """JSON 工具类（优先使用 orjson，未安装时回退到标准库 json）"""
+
+    @staticmethod
+    def dumps(obj: Any, indent: bool = False) -> str:
+        """序列化为 JSON 字符串（保留非 ASCII 字符；indent 为 True 时缩进 2 格）"""
+        if orjson is not None:
+            option = orjson.OPT_INDENT_2 if indent else 0
+            return orjson.dumps(obj, option=option).decode()
+        if indent:
+            return json.dumps(obj, ensure_ascii=False, indent=2)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def dumps_bytes(obj: Any) -> bytes:
+        """序列化为紧凑的 UTF-8 JSON 字节串"""
+        if orjson is not None:
+            return orjson.dumps(obj)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+    @staticmethod
+    def loads(s: Union[str, bytes]) -> Any:
+        """解析 JSON 字符串或字节串，格式无效时抛出 ValueError"""
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s)
+
+
+@lru_cache(maxsize=32)
+def _sign_nonce_ctx(ssecurity: str) -> "hashlib._Hash":
+    """已吸收 ssecurity 的 SHA-256 上下文（同一会话的 ssecurity 不变，只需解码一次）"""
+    return hashlib.sha256(_b64d(ssecurity))
+
+
+@lru_cache(maxsize=64)
+def _rc4_hash_ctx(method: str, uri: str) -> "hashlib._Hash":
+    """已吸收 "METHOD&uri&" 前缀的 SHA-1 上下文"""
+    parts = []
+    if method:
+        parts.append(method.upper())
+    if uri:
+        parts.append(uri)
+    prefix = "&".join(parts) + "&" if parts else ""
+    return hashlib.sha1(prefix.encode())
+
+
+def _rc4_hash_with(ctx: "hashlib._Hash", *fields: bytes) -> str:
+    """在前缀上下文的副本上追加 "&" 连接的各字段，返回 base64 编码的 SHA-1"""
+    m = ctx.copy()
+    m.update(b"&".join(fields))
+    return _b64e(m.digest())
+
 
 class HashUtils:
     """哈希工具类"""
 
     @staticmethod
-    def md5(s: str) -> str:
+    def md5(s: Union[str, bytes]) -> str:
         """计算 MD5 哈希值"""
-        return hashlib.md5(s.encode()).hexdigest()
+        if isinstance(s, str):
+            s = s.encode()
+        return hashlib.md5(s).hexdigest()
 
     @staticmethod
-    def sha1(s: str) -> str:
+    def sha1(s: Union[str, bytes]) -> str:
         """计算 SHA1 哈希值（base64）"""
-        return base64.b64encode(hashlib.sha1(s.encode()).digest()).decode()
+        if isinstance(s, str):
+            s = s.encode()
+        return _b64e(hashlib.sha1(s).digest())
 
     @staticmethod
     def sha256(snonce: bytes, msg: str) -> str:
@@ -37,56 +131,94 @@ class HashUtils:
     @staticmethod
     def sign_nonce(ssecurity: str, nonce: str) -> str:
         """签名 nonce"""
-        m = hashlib.sha256()
-        m.update(base64.b64decode(ssecurity))
-        m.update(base64.b64decode(nonce))
-        return base64.b64encode(m.digest()).decode()
+        return _b64e(HashUtils.sign_nonce_digest(ssecurity, nonce))
+
+    @staticmethod
+    def sign_nonce_digest(ssecurity: str, nonce: str) -> bytes:
+        """签名 nonce（返回原始摘要，可直接作为 RC4 密钥）"""
+        m = _sign_nonce_ctx(ssecurity).copy()
+        m.update(_b64d(nonce))
+        return m.digest()
 
     @staticmethod
     def uuid() -> str:
         """生成 UUID"""
-        import uuid as uuid_lib
         return str(uuid_lib.uuid4())
 
     @staticmethod
     def random_noise() -> str:
         """生成随机噪声（12字节，base64编码）"""
-        noise = bytes([random.randint(0, 255) for _ in range(12)])
-        return base64.b64encode(noise).decode()
+        # nonce 参与 RC4 密钥派生，使用密码学安全的随机数
+        return _b64e(secrets.token_bytes(12))
+
+
+@lru_cache(maxsize=256)
+def _rc4_initial_state(key: bytes, drop: int) -> Tuple[bytes, int, int]:
+    """计算 RC4 完成 KSA 并丢弃 drop 字节密钥流后的状态 (S 盒, i, j)"""
+    # 初始化 S 盒（密钥预先扩展到 256 字节，循环内只用局部变量）
+    s = bytearray(range(256))
+    key_stream = (key * (256 // len(key) + 1))[:256]
+    j = 0
+    for i, k in enumerate(key_stream):
+        j = (j + s[i] + k) & 255
+        s[i], s[j] = s[j], s[i]
+
+    # 丢弃密钥流只需推进状态，不生成输出
+    i = j = 0
+    for _ in range(drop):
+        i = (i + 1) & 255
+        j = (j + s[i]) & 255
+        s[i], s[j] = s[j], s[i]
+    return bytes(s), i, j
 
 
 class RC4:
-    """RC4 加密/解密类"""
+    """RC4 加密/解密类
 
-    def __init__(self, key: bytes):
-        self.iii = 0
-        self.jjj = 0
-        self.bytes = bytearray(256)
-        length = len(key)
+    安装了 PyCryptodome 时使用其 C 实现；否则使用纯 Python 实现：
+    密钥流逐字节生成（i/j/S 盒存在串行依赖，无法按字节并行），
+    与明文的异或则通过大整数一次完成，相当于整段数据按机器字宽并行处理。
+    """
 
-        # 初始化 S 盒
-        for i in range(256):
-            self.bytes[i] = i
+    def __init__(self, key: bytes, drop: int = 0):
+        """drop 为初始化后丢弃的密钥流字节数（RC4-drop[n]）"""
+        if _ARC4 is not None:
+            self._cipher = _ARC4.new(bytes(key), drop=drop)
+            return
 
-        j = 0
-        for i in range(256):
-            j = (j + self.bytes[i] + key[i % length]) & 255
-            self.bytes[i], self.bytes[j] = self.bytes[j], self.bytes[i]
+        self._cipher = None
+        # 初始状态按 (密钥, drop) 缓存，同一 nonce 的请求/响应不必重复 KSA 和丢弃
+        state, self.iii, self.jjj = _rc4_initial_state(bytes(key), drop)
+        self.bytes = bytearray(state)
 
-    def update(self, data: bytearray) -> bytearray:
+    def update(self, data: Union[bytes, bytearray]) -> bytes:
         """更新数据流"""
-        result = bytearray(data)
-        for i in range(len(result)):
-            self.iii = (self.iii + 1) & 255
-            self.jjj = (self.jjj + self.bytes[self.iii]) & 255
-            self.bytes[self.iii], self.bytes[self.jjj] = (
-                self.bytes[self.jjj],
-                self.bytes[self.iii],
-            )
-            result[i] ^= self.bytes[
-                (self.bytes[self.iii] + self.bytes[self.jjj]) & 255
-            ]
-        return result
+        if self._cipher is not None:
+            return self._cipher.encrypt(bytes(data))
+
+        n = len(data)
+        if not n:
+            return b""
+        # 先生成整段密钥流，再用大整数一次性完成异或（在 C 层执行，不逐字节循环）
+        keystream = self._keystream(n)
+        return (
+            int.from_bytes(data, "big") ^ int.from_bytes(keystream, "big")
+        ).to_bytes(n, "big")
+
+    def _keystream(self, n: int) -> bytearray:
+        """生成 n 字节密钥流"""
+        out = bytearray(n)
+        s = self.bytes
+        i = self.iii
+        j = self.jjj
+        for k in range(n):
+            i = (i + 1) & 255
+            j = (j + s[i]) & 255
+            s[i], s[j] = s[j], s[i]
+            out[k] = s[(s[i] + s[j]) & 255]
+        self.iii = i
+        self.jjj = j
+        return out
 
 
 class CodecUtils:
@@ -103,28 +235,31 @@ class CodecUtils:
         return base64.b64decode(base64_str).decode()
 
     @staticmethod
-    def parse_auth_pass(res: str) -> Dict[str, Any]:
+    def parse_auth_pass(res: Union[str, bytes]) -> Dict[str, Any]:
         """解析认证响应"""
         try:
+            # 统一按字节串处理，省去解码
+            if isinstance(res, str):
+                res = res.encode()
             # 去除前缀
-            res = res.replace("&&&START&&&", "")
+            res = res.replace(b"&&&START&&&", b"")
             # 将大数字转为字符串
-            import re
-            res = re.sub(r":(\d{9,})", r':"\1"', res)
-            return json.loads(res)
+            res = _BIGNUM_RE.sub(rb':"\1"', res)
+            return JsonUtils.loads(res)
         except:
             return {}
 
     @staticmethod
     def encode_query(data: Dict[str, Any]) -> str:
         """编码查询字符串"""
-        parts = []
-        for key, value in data.items():
-            if value is not None:
-                parts.append(
-                    f"{urllib.parse.quote(str(key))}={urllib.parse.quote(str(value))}"
-                )
-        return "&".join(parts)
+        quote = urllib.parse.quote
+        return "&".join(
+            [
+                f"{_quote_key(str(key))}={quote(str(value), safe='/')}"
+                for key, value in data.items()
+                if value is not None
+            ]
+        )
 
     @staticmethod
     def decode_query(query_str: str) -> Dict[str, Any]:
@@ -149,17 +284,9 @@ class CodecUtils:
     @staticmethod
     def rc4_hash(method: str, uri: str, data: Dict[str, str], ssecurity: str) -> str:
         """计算 RC4 哈希"""
-        array_list = []
-        if method:
-            array_list.append(method.upper())
-        if uri:
-            array_list.append(uri)
-        if data:
-            for k, v in data.items():
-                array_list.append(f"{k}={v}")
-        array_list.append(ssecurity)
-        sb = "&".join(array_list)
-        return HashUtils.sha1(sb)
+        fields = [f"{k}={v}".encode() for k, v in data.items()] if data else []
+        fields.append(ssecurity.encode())
+        return _rc4_hash_with(_rc4_hash_ctx(method, uri), *fields)
 
     @staticmethod
     def encode_miot(
@@ -167,26 +294,37 @@ class CodecUtils:
     ) -> Dict[str, str]:
         """编码 MIoT 请求"""
         nonce = HashUtils.random_noise()
-        snonce = HashUtils.sign_nonce(ssecurity, nonce)
-        key = base64.b64decode(snonce)
-        rc4 = RC4(key)
-        # 更新 1024 字节
-        rc4.update(bytearray(1024))
-
-        json_str = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
-        map_data: Dict[str, str] = {"data": json_str}
-        map_data["rc4_hash__"] = CodecUtils.rc4_hash(method, uri, map_data, snonce)
-
-        # RC4 加密
-        for k in map_data:
-            v = map_data[k]
-            encrypted = rc4.update(bytearray(v.encode()))
-            map_data[k] = base64.b64encode(encrypted).decode()
-
-        map_data["signature"] = CodecUtils.rc4_hash(method, uri, map_data, snonce)
-        map_data["_nonce"] = nonce
-        map_data["ssecurity"] = ssecurity
-        return map_data
+        key = HashUtils.sign_nonce_digest(ssecurity, nonce)
+        snonce = _b64e(key)
+        # 丢弃前 1024 字节密钥流
+        rc4 = RC4(key, drop=1024)
+
+        # 两次哈希共用 "METHOD&uri&" 前缀上下文，直接按固定字段计算，不遍历字典
+        prefix_ctx = _rc4_hash_ctx(method, uri)
+        snonce_bytes = snonce.encode()
+
+        json_bytes = JsonUtils.dumps_bytes(data)
+        rc4_hash = _rc4_hash_with(prefix_ctx, b"data=" + json_bytes, snonce_bytes)
+
+        # RC4 加密：data、rc4_hash__ 依次使用同一段密钥流，拼接后一次加密再切分
+        encrypted = rc4.update(json_bytes + rc4_hash.encode())
+        split = len(json_bytes)
+        encrypted_data = _b64e(encrypted[:split])
+        encrypted_hash = _b64e(encrypted[split:])
+
+        signature = _rc4_hash_with(
+            prefix_ctx,
+            f"data={encrypted_data}".encode(),
+            f"rc4_hash__={encrypted_hash}".encode(),
+            snonce_bytes,
+        )
+        return {
+            "data": encrypted_data,
+            "rc4_hash__": encrypted_hash,
+            "signature": signature,
+            "_nonce": nonce,
+            "ssecurity": ssecurity,
+        }
 
     @staticmethod
     def decode_miot(
@@ -194,60 +332,75 @@ class CodecUtils:
     ) -> Optional[Dict[str, Any]]:
         """解码 MIoT 响应"""
         try:
-            key = base64.b64decode(HashUtils.sign_nonce(ssecurity, nonce))
-            rc4 = RC4(key)
-            # 更新 1024 字节
-            rc4.update(bytearray(1024))
+            key = HashUtils.sign_nonce_digest(ssecurity, nonce)
+            # 丢弃前 1024 字节密钥流
+            rc4 = RC4(key, drop=1024)
 
-            decrypted = rc4.update(bytearray(base64.b64decode(data)))
+            decrypted = rc4.update(_b64d(data))
 
             if gzip:
-                import gzip
-                decrypted = gzip.decompress(bytes(decrypted))
-                decrypted_str = decrypted.decode()
-            else:
-                decrypted_str = decrypted.decode()
+                decrypted = gzip_lib.decompress(decrypted)
 
-            return json.loads(decrypted_str)
+            # 直接解析字节串，不必先解码为字符串
+            return JsonUtils.loads(decrypted)
         except Exception as e:
             print(f"❌ decode_miot failed: {e}")
             return None
 
 
+# 默认请求头（只读，所有请求共用）
+_DEFAULT_HEADERS = MappingProxyType(
+    {
+        "Accept-Encoding": "gzip, deflate",
+        "Content-Type": "application/x-www-form-urlencoded",
+        "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 10; RMX2111 Build/QP1A.190711.020) APP/xiaomi.mico APPV/2004040 MK/Uk1YMjExMQ== PassportSDK/3.8.3 passport-ui/3.8.3",
+    }
+)
+
+# 所有 HttpClient 共用的连接池（含重试策略）
+_SHARED_ADAPTER = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+    ),
+)
+
+
 class HttpClient:
     """HTTP 客户端"""
 
     def __init__(self, timeout: int = 5000):
         self.timeout = timeout / 1000  # 转换为秒
+        # 每个实例使用独立的 Session（cookie 互不影响），但共用同一个连接池，
+        # 新建的 HttpClient 也能复用已建立的 TCP/TLS 连接
         self.session = requests.Session()
-        # 设置重试策略
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=0.3,
-            status_forcelist=[429, 500, 502, 503, 504],
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+        self.session.mount("http://", _SHARED_ADAPTER)
+        self.session.mount("https://", _SHARED_ADAPTER)
+
+    @staticmethod
+    def cookies_from(pairs: Iterable[Tuple[str, Any]]) -> Dict[str, Any]:
+        """由 (名称, 值) 列表构建 cookies，忽略空值"""
+        return {k: v for k, v in pairs if v}
 
     def _build_cookies(self, cookies: Dict[str, Any]) -> Dict[str, str]:
         """构建 cookies"""
+        # 值已经都是字符串时直接使用，不再复制
+        if all(isinstance(value, str) for value in cookies.values()):
+            return cookies
         result = {}
         for key, value in cookies.items():
             if value is not None:
                 result[key] = str(value)
         return result
 
-    def _build_headers(self, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
-        """构建请求头"""
-        default_headers = {
-            "Accept-Encoding": "gzip, deflate",
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 10; RMX2111 Build/QP1A.190711.020) APP/xiaomi.mico APPV/2004040 MK/Uk1YMjExMQ== PassportSDK/3.8.3 passport-ui/3.8.3",
-        }
-        if headers:
-            default_headers.update(headers)
-        return default_headers
+    def _build_headers(self, headers: Optional[Dict[str, str]] = None) -> Mapping[str, str]:
+        """构建请求头（没有额外请求头时直接返回共享的只读默认请求头）"""
+        if not headers:
+            return _DEFAULT_HEADERS
+        return {**_DEFAULT_HEADERS, **headers}
 
     def get(
         self,
@@ -257,7 +410,7 @@ class HttpClient:
         headers: Optional[Dict[str, str]] = None,
         raw_response: bool = False,
     ) -> Any:
-        """GET 请求"""
+        """GET 请求（返回响应体字节串；raw_response 为 True 时返回 Response；出错时返回错误字典）"""
         try:
             response = self.session.get(
                 url,
@@ -268,7 +421,7 @@ class HttpClient:
             )
             if raw_response:
                 return response
-            return response.text
+            return response.content
         except Exception as e:
             return {"isError": True, "error": str(e), "code": "未知", "message": str(e)}
 
@@ -280,7 +433,7 @@ class HttpClient:
         headers: Optional[Dict[str, str]] = None,
         raw_response: bool = False,
     ) -> Any:
-        """POST 请求"""
+        """POST 请求（返回值同 get）"""
         try:
             response = self.session.post(
                 url,
@@ -291,7 +444,7 @@ class HttpClient:
             )
             if raw_response:
                 return response
-            return response.text
+            return response.content
         except Exception as e:
             return {"isError": True, "error": str(e), "code": "未知", "message": str(e)}
 
@@ -3,6 +3,8 @@
 """
 import threading
 import time
+import traceback
+from collections import OrderedDict
 from typing import Callable, Dict, List, Optional
 
 try:
@@ -26,6 +28,12 @@ class VoiceMessage:
 class VoiceReceiver:
     """语音接收器，用于监听小米音箱的语音对话"""
 
+    # 空闲时每次只拉取最新 1 条判断是否有新消息，有新消息时再拉取最近 10 条
+    IDLE_FETCH_LIMIT = 1
+    ACTIVE_FETCH_LIMIT = 10
+    # 记录最近处理过的 requestId 数量上限，用于去重
+    SEEN_IDS_LIMIT = 256
+
     def __init__(self, mina: MiNA):
         """
         初始化语音接收器
@@ -35,6 +43,7 @@ class VoiceReceiver:
         """
         self.mina = mina
         self.last_timestamp = 0
+        self._seen_ids: "OrderedDict[str, None]" = OrderedDict()
         self.is_running = False
         self.thread: Optional[threading.Thread] = None
         self.stop_event = threading.Event()
@@ -65,10 +74,13 @@ class VoiceReceiver:
 
         # 启动轮询线程
         def poll_loop():
+            period = interval / 1000.0
             while not self.stop_event.is_set():
+                started = time.monotonic()
                 self._fetch_messages(callback, only_new)
-                # 等待指定时间（转换为秒）
-                self.stop_event.wait(interval / 1000.0)
+                # 按固定节奏轮询：扣除本次请求耗时后再等待（转换为秒）
+                elapsed = time.monotonic() - started
+                self.stop_event.wait(max(period - elapsed, 0))
 
         self.thread = threading.Thread(target=poll_loop, daemon=True)
         self.thread.start()
@@ -123,18 +135,48 @@ class VoiceReceiver:
     def _init_last_timestamp(self):
         """初始化最后一条消息的时间戳"""
         try:
-            conversations = self.mina.get_conversations(limit=1)
+            # 多取几条：与最新消息时间戳相同的历史消息也要标记为已处理，避免被当作新消息重放
+            conversations = self.mina.get_conversations(limit=self.ACTIVE_FETCH_LIMIT)
             if conversations and "records" in conversations and len(conversations["records"]) > 0:
-                self.last_timestamp = conversations["records"][0].get("time", 0)
+                records = conversations["records"]
+                self.last_timestamp = max(record.get("time", 0) for record in records)
+                for record in records:
+                    if record.get("time", 0) >= self.last_timestamp:
+                        self._mark_seen(record.get("requestId"))
         except Exception as e:
             print(f"⚠️ 初始化时间戳失败: {e}")
 
+    def _mark_seen(self, request_id: Optional[str]):
+        """记录已处理的 requestId，超过上限时淘汰最早的记录"""
+        if not request_id:
+            return
+        self._seen_ids[request_id] = None
+        if len(self._seen_ids) > self.SEEN_IDS_LIMIT:
+            self._seen_ids.popitem(last=False)
+
+    def _is_new_record(self, record: Dict, last_timestamp: int) -> bool:
+        """判断消息是否未处理过：有 requestId 时按 requestId 去重，同一时间戳的多条消息不会漏掉"""
+        record_time = record.get("time", 0)
+        request_id = record.get("requestId")
+        if request_id:
+            return request_id not in self._seen_ids and record_time >= last_timestamp
+        return record_time > last_timestamp
+
     def _fetch_messages(
         self, callback: Callable[[VoiceMessage], None], only_new: bool
     ):
         """获取消息并触发回调"""
         try:
-            conversations = self.mina.get_conversations(limit=10)
+            if only_new:
+                # 先只取最新 1 条判断是否有新消息，空闲时（绝大多数轮询）减少流量和解析开销
+                latest = self.mina.get_conversations(limit=self.IDLE_FETCH_LIMIT)
+                records = latest.get("records") if latest else None
+                if records is not None and (
+                    not records or not self._is_new_record(records[0], self.last_timestamp)
+                ):
+                    return
+
+            conversations = self.mina.get_conversations(limit=self.ACTIVE_FETCH_LIMIT)
 
             if not conversations:
                 print(f"⚠️ 获取对话列表为空")
@@ -144,19 +186,21 @@ class VoiceReceiver:
                 print(f"⚠️ 对话列表中没有 records 字段")
                 return
 
-            # 从新到旧排序
+            # 接口按从新到旧返回，这里按时间顺序处理
             records = conversations["records"]
+            last_timestamp = self.last_timestamp
 
             new_messages_count = 0
-            for record in records:
+            for record in reversed(records):
                 record_time = record.get("time", 0)
                 query_text = record.get("query", "")
 
-                # 如果只获取新消息，跳过已处理的消息
-                if only_new and record_time <= self.last_timestamp:
+                # 如果只获取新消息，跳过已处理的消息（与本轮开始时的时间戳比较）
+                if only_new and not self._is_new_record(record, last_timestamp):
                     continue
 
                 new_messages_count += 1
+                self._mark_seen(record.get("requestId"))
                 # 更新最后处理的时间戳
                 if record_time > self.last_timestamp:
                     self.last_timestamp = record_time
@@ -172,11 +216,9 @@ class VoiceReceiver:
                     callback(message)
                 except Exception as e:
                     print(f"❌ 回调函数执行失败: {e}")
-                    import traceback
                     traceback.print_exc()
 
         except Exception as e:
             print(f"❌ 获取语音消息失败: {e}")
-            import traceback
             traceback.print_exc()
 
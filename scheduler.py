@@ -2,14 +2,17 @@
 定时任务调度模块
 处理定时任务的增删改查和调度执行
 """
-import json
+import copy
 import os
 import threading
 import schedule
 import time as time_module
+import traceback
 import uuid
 from flask import request, jsonify
 
+from json_store import JsonFileCache
+
 # 定时任务配置文件路径
 base_dir = os.path.dirname(os.path.abspath(__file__))
 SCHEDULES_CONFIG_FILE = os.path.join(base_dir, 'datas', 'schedules.json')
@@ -17,30 +20,36 @@ SCHEDULES_CONFIG_FILE = os.path.join(base_dir, 'datas', 'schedules.json')
 # 全局调度器线程
 scheduler_thread = None
 scheduler_running = False
+# 任务变更或停止时唤醒调度线程，重新计算下次等待时间
+scheduler_wakeup = threading.Event()
+
+# 调度线程单次最长等待时间（秒），防止系统时间被校正（NTP）后错过任务
+SCHEDULER_MAX_IDLE = 60
 
 # 需要从 app.py 导入的函数（通过回调方式注入）
 execute_device_action_callback = None
 add_log_to_queue_callback = None
-get_device_by_id_callback = None
+iter_devices_by_ids_callback = None
+
+
+# 定时任务配置内存缓存，按 schedules.json 的修改时间失效
+_store = JsonFileCache(SCHEDULES_CONFIG_FILE, "定时任务配置")
+
+
+def _load_cached_schedules():
+    """获取定时任务配置缓存（返回的数据是共享的，调用方不能修改）"""
+    return _store.get()
 
 
 def load_schedules():
-    """加载定时任务配置"""
-    try:
-        if os.path.exists(SCHEDULES_CONFIG_FILE):
-            with open(SCHEDULES_CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
-    except Exception as e:
-        print(f"加载定时任务配置失败: {e}")
-        return []
+    """加载定时任务配置（返回副本，调用方可以直接修改后保存）"""
+    return copy.deepcopy(_load_cached_schedules())
 
 
 def save_schedules(schedules):
     """保存定时任务配置"""
     try:
-        with open(SCHEDULES_CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(schedules, f, ensure_ascii=False, indent=2)
+        _store.save(schedules)
         return True
     except Exception as e:
         print(f"保存定时任务配置失败: {e}")
@@ -48,9 +57,8 @@ def save_schedules(schedules):
 
 
 def get_schedule_by_id(schedule_id):
-    """根据 ID 获取定时任务"""
-    schedules = load_schedules()
-    for schedule in schedules:
+    """根据 ID 获取定时任务（返回缓存中的任务，调用方不能修改）"""
+    for schedule in _load_cached_schedules():
         if schedule.get('id') == schedule_id:
             return schedule
     return None
@@ -85,7 +93,6 @@ def execute_scheduled_task(schedule_data):
             
     except Exception as e:
         print(f"❌ 定时任务执行出错: {e}")
-        import traceback
         traceback.print_exc()
 
 
@@ -149,8 +156,8 @@ def load_and_setup_schedules():
         # 清除所有现有任务
         schedule.clear()
         
-        # 加载任务配置
-        schedules = load_schedules()
+        # 加载任务配置（只读，直接使用缓存）
+        schedules = _load_cached_schedules()
         
         print(f"📅 加载定时任务: {len(schedules)} 个")
         
@@ -163,8 +170,10 @@ def load_and_setup_schedules():
                 
     except Exception as e:
         print(f"❌ 加载定时任务失败: {e}")
-        import traceback
         traceback.print_exc()
+    finally:
+        # 任务列表已变化，唤醒调度线程按新的下次执行时间等待
+        scheduler_wakeup.set()
 
 
 def reload_scheduler():
@@ -181,8 +190,13 @@ def run_scheduler():
     
     while scheduler_running:
         try:
+            scheduler_wakeup.clear()
             schedule.run_pending()
-            time_module.sleep(1)
+            # 一直等到下一个任务的执行时间（没有任务时等待最长间隔），而不是每秒轮询
+            idle = schedule.idle_seconds()
+            if idle is None:
+                idle = SCHEDULER_MAX_IDLE
+            scheduler_wakeup.wait(min(max(idle, 0), SCHEDULER_MAX_IDLE))
         except Exception as e:
             print(f"❌ 调度器运行出错: {e}")
             time_module.sleep(5)
@@ -208,6 +222,7 @@ def stop_scheduler():
     """停止调度器"""
     global scheduler_running
     scheduler_running = False
+    scheduler_wakeup.set()
     print("🛑 定时任务调度器已停止")
 
 
@@ -220,16 +235,21 @@ def register_schedule_routes(app):
         try:
             schedules = load_schedules()
             
-            # 补充设备和操作名称
-            if get_device_by_id_callback:
+            # 补充设备和操作名称（一次性批量获取所有相关设备）
+            if iter_devices_by_ids_callback:
+                device_ids = {schedule_item.get('device_id') for schedule_item in schedules}
+                devices = {
+                    device.get('id'): device
+                    for device in iter_devices_by_ids_callback(device_ids)
+                }
                 for schedule_item in schedules:
-                    device = get_device_by_id_callback(schedule_item.get('device_id'))
+                    device = devices.get(schedule_item.get('device_id'))
                     if device:
                         schedule_item['device_name'] = device.get('name')
                         schedule_item['device_app'] = device.get('app')
                         
                         # 查找操作名称
-                        for action in device.get('actions', []):
+                        for action in device.get('actions') or []:
                             if action.get('id') == schedule_item.get('action_id'):
                                 schedule_item['action_name'] = action.get('name')
                                 break
@@ -0,0 +1,48 @@
+"""
+语音接收器测试
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mi"))
+
+from voice import VoiceReceiver  # noqa: E402
+
+
+class FakeMiNA:
+    """按从新到旧返回预设对话记录的假 MiNA"""
+
+    def __init__(self, records):
+        self.records = records
+
+    def get_conversations(self, limit=10, timestamp=None):
+        return {"records": self.records[:limit]}
+
+
+def _record(request_id, time, query=None):
+    return {"requestId": request_id, "time": time, "query": query or request_id}
+
+
+def test_history_with_same_timestamp_is_not_replayed():
+    mina = FakeMiNA([_record("r0", 100), _record("rX", 100, "old2-same-ms")])
+    receiver = VoiceReceiver(mina)
+    receiver._init_last_timestamp()
+
+    mina.records[:0] = [_record("B", 200), _record("A", 150)]
+    dispatched = []
+    receiver._fetch_messages(lambda message: dispatched.append(message.text), True)
+
+    assert dispatched == ["A", "B"]
+
+
+def test_new_records_sharing_a_timestamp_are_all_dispatched():
+    mina = FakeMiNA([_record("r0", 100)])
+    receiver = VoiceReceiver(mina)
+    receiver._init_last_timestamp()
+
+    mina.records[:0] = [_record("B", 200), _record("A", 200)]
+    dispatched = []
+    receiver._fetch_messages(lambda message: dispatched.append(message.text), True)
+    receiver._fetch_messages(lambda message: dispatched.append(message.text), True)
+
+    assert dispatched == ["A", "B"]